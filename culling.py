@@ -0,0 +1,135 @@
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError: # Numba is optional, fall back to the NumPy implementation
+    njit = None
+
+AIR_ID = 0
+
+# Regions with fewer solid cells than this are culled from their solid cells only, see cull_sparse
+SPARSE_DENSITY = 0.2
+
+# Face bits, for the three faces visible in the isometric view
+FACE_EAST = 1 # +X
+FACE_SOUTH = 2 # +Z
+FACE_UP = 4 # +Y
+ALL_FACES = FACE_EAST | FACE_SOUTH | FACE_UP
+
+def hidden_faces(grid, transparent, axis):
+    """
+    Returns a bool mask of cells whose face towards +axis is covered by its neighbour.
+    A face is covered when the neighbour is solid, or when both blocks are the same
+    transparent block (e.g. glass next to glass).
+    Cells on the far border of the region always keep that face.
+    """
+    hidden = np.zeros(grid.shape, dtype=bool)
+    inner = [slice(None)] * 3
+    outer = [slice(None)] * 3
+    inner[axis] = slice(None, -1)
+    outer[axis] = slice(1, None)
+
+    block = grid[tuple(inner)]
+    neighbor = grid[tuple(outer)]
+    hidden[tuple(inner)] = (block != AIR_ID) & (neighbor != AIR_ID) & np.where(
+        transparent[block], neighbor == block, ~transparent[neighbor]
+    )
+    return hidden
+
+def _cull_numpy(grid, transparent):
+    face_mask = np.zeros(grid.shape, dtype=np.int32)
+    for axis, face_bit in ((2, FACE_EAST), (1, FACE_SOUTH), (0, FACE_UP)):
+        face_mask[~hidden_faces(grid, transparent, axis)] |= face_bit
+
+    yi, zi, xi = np.nonzero(grid != AIR_ID)
+    return np.stack((xi, yi, zi, grid[yi, zi, xi], face_mask[yi, zi, xi]), axis=1).astype(np.int32)
+
+if njit is not None:
+    @njit(cache=True)
+    def _covers(block, neighbor, transparent):
+        if neighbor == AIR_ID:
+            return False
+        if transparent[block]:
+            return neighbor == block
+        return not transparent[neighbor]
+
+    @njit(parallel=True, cache=True)
+    def _cull_numba(grid, transparent):
+        dy, dz, dx = grid.shape
+
+        # First pass: count solid cells per layer, so each layer knows where its rows start
+        counts = np.zeros(dy, dtype=np.int64)
+        for y in prange(dy):
+            count = 0
+            for z in range(dz):
+                for x in range(dx):
+                    if grid[y, z, x] != AIR_ID:
+                        count += 1
+            counts[y] = count
+        offsets = np.zeros(dy + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+
+        out = np.empty((offsets[dy], 5), dtype=np.int32)
+        for y in prange(dy):
+            i = offsets[y]
+            for z in range(dz):
+                for x in range(dx):
+                    block = grid[y, z, x]
+                    if block == AIR_ID:
+                        continue
+                    face_mask = 0
+                    if x + 1 >= dx or not _covers(block, grid[y, z, x + 1], transparent):
+                        face_mask |= FACE_EAST
+                    if z + 1 >= dz or not _covers(block, grid[y, z + 1, x], transparent):
+                        face_mask |= FACE_SOUTH
+                    if y + 1 >= dy or not _covers(block, grid[y + 1, z, x], transparent):
+                        face_mask |= FACE_UP
+                    out[i, 0] = x
+                    out[i, 1] = y
+                    out[i, 2] = z
+                    out[i, 3] = block
+                    out[i, 4] = face_mask
+                    i += 1
+        return out
+
+def cull_sparse(keys, blocks, shape, transparent):
+    """
+    Same as cull() for a region given as its solid cells only, without a dense grid.
+    keys: sorted flat (y, z, x) indices of the solid cells; blocks: their block ids;
+    shape: the (y, z, x) grid shape. Neighbours are found by binary search of the
+    sorted keys instead of indexing a grid.
+    """
+    dy, dz, dx = shape
+    keys = np.asarray(keys, dtype=np.int64)
+    blocks = np.asarray(blocks, dtype=np.int32)
+    if not len(keys):
+        return np.empty((0, 5), dtype=np.int32)
+    yz, xi = np.divmod(keys, dx)
+    yi, zi = np.divmod(yz, dz)
+    
+    face_mask = np.zeros(len(keys), dtype=np.int32)
+    for coord, size, stride, face_bit in ((xi, dx, 1, FACE_EAST), (zi, dz, dx, FACE_SOUTH), (yi, dy, dx * dz, FACE_UP)):
+        neighbor_keys = keys + stride
+        if stride == 1:
+            # The +X neighbour, if solid, is the next key
+            idx = np.minimum(np.arange(1, len(keys) + 1), len(keys) - 1)
+        else:
+            idx = np.minimum(np.searchsorted(keys, neighbor_keys), len(keys) - 1)
+        found = (coord + 1 < size) & (keys[idx] == neighbor_keys)
+        # Cells without a solid neighbour see air, like the far border of the region
+        neighbor = np.where(found, blocks[idx], AIR_ID)
+        covered = (neighbor != AIR_ID) & np.where(transparent[blocks], neighbor == blocks, ~transparent[neighbor])
+        face_mask[~covered] |= face_bit
+    
+    return np.stack((xi, yi, zi, blocks, face_mask), axis=1).astype(np.int32)
+
+def cull(grid, transparent):
+    """
+    Finds the solid blocks of a (y, z, x) grid of block ids and their visible faces.
+    transparent: bool array indexed by block id.
+    Returns an int32 array of (x, y, z, block, face_mask) rows, with x/y/z in grid
+    indices, in back-to-front drawing order (y, then z, then x).
+    """
+    if njit is not None:
+        return _cull_numba(grid, transparent)
+    return _cull_numpy(grid, transparent)
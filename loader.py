@@ -1,13 +1,26 @@
 import os
 import json
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from PIL import Image
 from io import BytesIO
 
+try:
+    import orjson
+except ImportError: # orjson is optional, it only speeds up loading the model cache
+    orjson = None
+
 ASSETS_BASE_URL = "https://raw.githubusercontent.com/InventivetalentDev/minecraft-assets/1.19.4/assets/minecraft"
 # Use a consistent cache directory relative to this file
 CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
 
+# One pooled session for all asset downloads, so connections are kept alive
+PREFETCH_WORKERS = 16
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=PREFETCH_WORKERS, pool_maxsize=PREFETCH_WORKERS))
+
 # Manual mapping for blocks that don't have a direct model file
 # or use a different name for their model (e.g. state-dependent blocks)
 BLOCK_MODEL_MAP = {
@@ -23,13 +36,70 @@ BLOCK_MODEL_MAP = {
 
 def ensure_cache_dir():
     if not os.path.exists(CACHE_DIR):
-        os.makedirs(CACHE_DIR)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+def write_cache_file(cache_path, save):
+    """
+    Writes a cache file through a temporary file, so concurrent readers never see a partial file.
+    save: callable writing the content to the path it is given.
+    """
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        save(tmp_path)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        # Don't leave the temporary file behind in the cache
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _dump_json(data, path):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+def _load_json(path):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+# All cached models, by "block/name" or "item/name". Filled on the first get_model_file call.
+_MODEL_RAM_CACHE = {}
+_MODEL_RAM_CACHE_LOCK = threading.Lock()
+_model_ram_cache_loaded = False
+
+def _load_all_cached():
+    """
+    Loads every cached model JSON into _MODEL_RAM_CACHE, once.
+    """
+    global _model_ram_cache_loaded
+    with _MODEL_RAM_CACHE_LOCK:
+        if _model_ram_cache_loaded:
+            return
+        for model_type in ("block", "item"):
+            model_dir = os.path.join(CACHE_DIR, model_type)
+            if not os.path.isdir(model_dir):
+                continue
+            with os.scandir(model_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".json") or not entry.is_file():
+                        continue
+                    try:
+                        _MODEL_RAM_CACHE[f"{model_type}/{entry.name[:-5]}"] = _load_json(entry.path)
+                    except ValueError as e:
+                        print(f"Warning: Ignoring invalid cached model {entry.path}: {e}")
+        _model_ram_cache_loaded = True
 
 def get_model_file(block_name):
     """
     Fetches the block model JSON from the assets server.
+    Cached models are served from memory; the returned dict must not be modified.
     """
     ensure_cache_dir()
+    if not _model_ram_cache_loaded:
+        _load_all_cached()
     
     name = block_name.replace("minecraft:", "")
     
@@ -43,25 +113,33 @@ def get_model_file(block_name):
         model_type = "block"
         clean_name = name
     
-    # Check cache first (flat cache for now, or structured?)
+    # Check cache first: memory, then disk (for files written since, e.g. by another process)
     # Let's use structure matching the type
+    cache_key = f"{model_type}/{clean_name}"
+    if cache_key in _MODEL_RAM_CACHE:
+        return _MODEL_RAM_CACHE[cache_key]
+    
     cache_path = os.path.join(CACHE_DIR, model_type, f"{clean_name}.json")
     if os.path.exists(cache_path):
-        with open(cache_path, 'r') as f:
-            return json.load(f)
+        try:
+            data = _load_json(cache_path)
+            _MODEL_RAM_CACHE[cache_key] = data
+            return data
+        except ValueError as e:
+            # Corrupt cache file (e.g. truncated): treat it as missing and download it again
+            print(f"Warning: Ignoring invalid cached model {cache_path}: {e}")
 
     url = f"{ASSETS_BASE_URL}/models/{model_type}/{clean_name}.json"
     print(f"Fetching model: {url}")
     
     try:
-        response = requests.get(url)
+        response = _SESSION.get(url)
         response.raise_for_status()
         data = response.json()
         
         # Save to cache
-        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-        with open(cache_path, 'w') as f:
-            json.dump(data, f)
+        write_cache_file(cache_path, lambda path: _dump_json(data, path))
+        _MODEL_RAM_CACHE[cache_key] = data
             
         return data
     except Exception as e:
@@ -93,36 +171,106 @@ def get_texture_image(texture_name):
     print(f"Fetching texture: {url}")
     
     try:
-        response = requests.get(url)
+        response = _SESSION.get(url)
         response.raise_for_status()
         image = Image.open(BytesIO(response.content))
         
         # Save to cache
-        # Ensure subdirectory exists if needed
-        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-        image.save(cache_path)
+        write_cache_file(cache_path, lambda path: image.save(path, format="PNG"))
         
         return image
     except Exception as e:
         print(f"Error loading texture {texture_name}: {e}")
         return None
 
-def deep_assign(target, source):
+def _prefetch_model(block_id):
     """
-    Recursively merges source into target.
+    resolve_model for prefetching: errors are logged and the block is left for the renderer to handle.
     """
-    for key, val in source.items():
-        if isinstance(val, dict):
-            target.setdefault(key, {})
-            deep_assign(target[key], val)
-        else:
-            target[key] = val
+    try:
+        return resolve_model(block_id)
+    except Exception as e:
+        print(f"Error prefetching model for {block_id}: {e}")
+        return {}, False
+
+def prefetch_assets(block_ids):
+    """
+    Downloads the models and textures of the given blocks concurrently,
+    so rendering afterwards is served from the cache.
+    Returns (failed_models, failed_textures): the partially resolved model ({} if none) of each
+    block whose model chain could not be fully loaded, by block id, and the set of texture refs
+    that could not be loaded, so callers don't request them again.
+    """
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as executor:
+        # Parents are only known once a model is loaded, so each block walks its own chain
+        results = list(executor.map(_prefetch_model, block_ids))
+        
+        failed_models = {}
+        textures = set()
+        for block_id, (model, complete) in zip(block_ids, results):
+            if not complete:
+                failed_models[block_id] = model
+            for texture_ref in model.get('textures', {}).values():
+                if not texture_ref.startswith('#'):
+                    textures.add(texture_ref)
+        
+        textures = sorted(textures)
+        images = executor.map(get_texture_image, textures)
+        failed_textures = {texture_ref for texture_ref, image in zip(textures, images) if image is None}
+    
+    return failed_models, failed_textures
+
+def _iter_merge(target, source):
+    """
+    Merges source into target, iteratively (explicit stack instead of recursion).
+    Nested dicts of target are copied before being written to, so ones shared
+    with a cached model are never modified.
+    """
+    stack = [(target, source)]
+    while stack:
+        dst, src = stack.pop()
+        for key, val in src.items():
+            if isinstance(val, dict):
+                sub = dst.get(key)
+                sub = dict(sub) if isinstance(sub, dict) else {}
+                dst[key] = sub
+                stack.append((sub, val))
+            else:
+                dst[key] = val
     return target
 
+# Resolved model chains, by name. Only complete chains (including ones ending in a
+# builtin/* model) are kept, so a failed download is retried on the next call
+# instead of sticking for the whole process.
+_RESOLVED_MODELS = {}
+
 def parse_model(block_name):
     """
     Parses a model and its parents.
+    The result is memoized and shared between callers; it must not be modified.
     """
+    return resolve_model(block_name)[0]
+
+def resolve_model(block_name):
+    """
+    Same as parse_model, but returns (model, complete).
+    complete is False if the model or one of its ancestors could not be loaded;
+    model is then {} or whatever part of the chain could be merged.
+    """
+    model = _RESOLVED_MODELS.get(block_name)
+    if model is not None:
+        return model, True
+    if block_name.startswith("builtin/"):
+        # builtin/* models (generated, entity) are hardcoded in the game, there is no file to load.
+        # They end the chain as an empty model, so chains ending there count as resolved.
+        _RESOLVED_MODELS[block_name] = {}
+        return {}, True
+    model, complete = _resolve_chain(block_name)
+    if complete:
+        _RESOLVED_MODELS[block_name] = model
+    return model, complete
+
+def _resolve_chain(block_name):
     # Check manual map first
     clean_name = block_name.replace("minecraft:", "")
     if clean_name in BLOCK_MODEL_MAP:
@@ -142,7 +290,7 @@ def parse_model(block_name):
     if not model_data:
         # Check for built-in fallbacks for fluids and signs
         if block_name in ["minecraft:water", "minecraft:lava"]:
-             return {
+             return ({
                  "elements": [{
                      "from": [0, 0, 0],
                      "to": [16, 16, 16],
@@ -158,13 +306,13 @@ def parse_model(block_name):
                  "textures": {
                      "all": "block/water_still" if block_name == "minecraft:water" else "block/lava_still"
                  }
-             }
+             }, True)
         
         # Fallback for signs (wall and standing)
         if "_sign" in block_name:
             wood_type = block_name.replace("minecraft:", "").replace("_wall_sign", "").replace("_sign", "")
             # Simple sign board model
-            return {
+            return ({
                 "elements": [{
                     "from": [0, 4, 0], 
                     "to": [16, 12, 2], 
@@ -180,14 +328,16 @@ def parse_model(block_name):
                 "textures": {
                     "all": f"block/{wood_type}_planks"
                 }
-            }
+            }, True)
 
         # If still failed, log it
         print(f"Error: Could not load model for {block_name} (tried block and item)")
-        return {}
+        return {}, False
 
+    complete = True
     if 'parent' in model_data:
-        parent_model = parse_model(model_data['parent'])
-        model_data = deep_assign(parent_model, model_data)
+        # Each ancestor chain is resolved once; only the child is overlaid here
+        parent_model, complete = resolve_model(model_data['parent'])
+        model_data = _iter_merge(dict(parent_model), model_data)
         
-    return model_data
+    return model_data, complete
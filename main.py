@@ -1,6 +1,7 @@
 import os
 import argparse
 import glob
+from multiprocessing import Pool
 from renderer import LitematicRenderer
 
 def process_file(input_path, output_path):
@@ -14,10 +15,17 @@ def process_file(input_path, output_path):
         import traceback
         traceback.print_exc()
 
+def process_job(job):
+    """
+    Pool entry point: job is an (input_path, output_path) tuple.
+    """
+    process_file(*job)
+
 def main():
     parser = argparse.ArgumentParser(description="Render litematic files to isometric images.")
     parser.add_argument("input", nargs='?', default=".", help="Path to input .litematic file or directory containing them (default: current directory)")
     parser.add_argument("-o", "--output", help="Path to output .png file (only used for single file input)", default=None)
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of files to render in parallel in batch mode (default: number of CPUs)")
     
     args = parser.parse_args()
     
@@ -40,12 +48,23 @@ def main():
             
         print(f"Found {len(files)} files to render.")
         
+        jobs = []
         for file_path in files:
             file_name = os.path.basename(file_path)
             output_name = os.path.splitext(file_name)[0] + ".png"
             output_path = os.path.join(res_dir, output_name)
-            
-            process_file(file_path, output_path)
+            jobs.append((file_path, output_path))
+        
+        # Each file is independent, so render them in separate processes.
+        # They share the on-disk model/texture/sprite caches, which are written atomically.
+        workers = min(args.jobs or os.cpu_count() or 1, len(jobs))
+        if workers > 1:
+            with Pool(workers) as pool:
+                for _ in pool.imap_unordered(process_job, jobs):
+                    pass
+        else:
+            for job in jobs:
+                process_job(job)
             
     elif os.path.isfile(input_path):
         # Single file mode
@@ -1,98 +1,382 @@
+import os
 import math
+import hashlib
+import functools
+from dataclasses import dataclass
 import numpy as np
 from PIL import Image, ImageDraw
 from litemapy import Region, Schematic
-from loader import parse_model, get_texture_image
+from loader import CACHE_DIR, resolve_model, get_texture_image, prefetch_assets, write_cache_file
 from utils import isometric_projection
+from culling import AIR_ID, ALL_FACES, FACE_EAST, FACE_SOUTH, FACE_UP, SPARSE_DENSITY, cull, cull_sparse
+from textured_face import warp_face
 
+TRANSPARENT_KEYWORDS = (
+    "glass", "ice", "water", "lava", "slime", "honey", "leaves", "beacon", "scaffolding", "spawner"
+)
+
+@functools.lru_cache(maxsize=None)
 def is_transparent(block_id):
     """
     Checks if a block is transparent (should not cull faces of different transparent blocks).
+    The keyword scan runs once per block id; later calls are a hash lookup.
     """
-    transparent_keywords = [
-        "glass", "ice", "water", "lava", "slime", "honey", "leaves", "beacon", "scaffolding", "spawner"
-    ]
-    for keyword in transparent_keywords:
+    for keyword in TRANSPARENT_KEYWORDS:
         if keyword in block_id:
             return True
     return False
 
+SPRITE_SCALE = 32
+
+# Rendered sprites are cached on disk next to the model/texture cache.
+# Bump SPRITE_CACHE_VERSION whenever the way sprites are drawn changes.
+SPRITE_CACHE_DIR = os.path.join(CACHE_DIR, "sprites")
+SPRITE_CACHE_VERSION = 3
+
+GRASS_TINT = (145, 189, 89) # Minecraft grass green
+
+# Faces in the order they are drawn for the painter's algorithm (back to front).
+# Viewing from front-right-top we see Up, South, East (Z is South, X is East);
+# Down, North and West are always hidden.
+RENDER_ORDER = (('east', FACE_EAST), ('south', FACE_SOUTH), ('up', FACE_UP))
+
+# In-memory sprite, texture array and compiled model caches, shared by all renderers in this process
+_BLOCK_SPRITES = {}
+_TEXTURE_ARRAYS = {}
+_COMPILED_MODELS = {}
+
+def next_power_of_two(n):
+    return 1 << max(n - 1, 0).bit_length()
+
+class ImagePool:
+    """
+    Reuses scratch images between faces instead of allocating one per face.
+    Images are square and bucketed by next_power_of_two(max(w, h)); acquire() returns one
+    at least as large as the requested size, of which only the (0, 0, w, h) box is used.
+    """
+    def __init__(self):
+        self._free = {}
+
+    def acquire(self, size, mode):
+        bucket = next_power_of_two(max(size))
+        free = self._free.get((mode, bucket))
+        if free:
+            return free.pop()
+        return Image.new(mode, (bucket, bucket), 0)
+
+    def release(self, img):
+        self._free.setdefault((img.mode, img.width), []).append(img)
+
+# Sprites are drawn one at a time (batch mode renders in separate processes), so a single pool is enough
+_POOL = ImagePool()
+
+def _apply_tint(rgba, tint_rgb):
+    """
+    Multiplies the color channels of an RGBA uint8 array by tint_rgb, in place.
+    Uses >> 8 instead of // 255, which is within 1 of the exact result.
+    """
+    rgba[..., :3] = (rgba[..., :3].astype(np.uint16) * np.array(tint_rgb, dtype=np.uint16)) >> 8
+    return rgba
+
+def _div255(values):
+    """
+    Rounded division of uint16 values (at most 255 * 255) by 255, using shifts only.
+    """
+    values = values + 128
+    return (values + (values >> 8)) >> 8
+
+def premultiply_sprite(sprite):
+    """
+    Converts a sprite to a premultiplied-alpha uint8 array, cropped to its visible pixels.
+    Returns (sprite_pm, ox, oy) with (ox, oy) the crop offset relative to the sprite
+    center, or None if the sprite is fully transparent.
+    """
+    bbox = sprite.getbbox(alpha_only=True)
+    if not bbox:
+        return None
+    x0, y0, x1, y1 = bbox
+    rgba = np.asarray(sprite.convert('RGBA'))[y0:y1, x0:x1].astype(np.uint16)
+    rgba[..., :3] = _div255(rgba[..., :3] * rgba[..., 3:4])
+    return rgba.astype(np.uint8), x0 - sprite.width // 2, y0 - sprite.height // 2
+
+def blend_over(canvas, sprite_pm, px, py):
+    """
+    Blends a premultiplied sprite "over" a premultiplied canvas, in place: dst = src + dst * (1 - src_a).
+    """
+    sh, sw = sprite_pm.shape[:2]
+    region = canvas[py:py + sh, px:px + sw]
+    inv_a = 255 - sprite_pm[..., 3:4].astype(np.uint16)
+    region[:] = sprite_pm + _div255(region * inv_a).astype(np.uint8)
+
+def unpremultiply(canvas_pm):
+    """
+    Converts a premultiplied-alpha canvas back to a straight-alpha RGBA image.
+    Only partially transparent pixels change; opaque and empty ones are already straight.
+    """
+    rgba = canvas_pm.copy()
+    alpha = rgba[..., 3]
+    partial = (alpha > 0) & (alpha < 255)
+    if partial.any():
+        pixels = rgba[partial].astype(np.uint16)
+        a = pixels[:, 3:4]
+        pixels[:, :3] = np.minimum((pixels[:, :3] * 255 + a // 2) // a, 255)
+        rgba[partial] = pixels.astype(np.uint8)
+    return Image.fromarray(rgba, 'RGBA')
+
+@dataclass
+class CompiledModel:
+    """
+    A block model flattened into per-element arrays.
+    Faces are indexed by RENDER_ORDER, as bits in face_bits/face_tint and
+    positions in the face_texture tuples.
+    """
+    from_coords: np.ndarray # (N, 3) float32, in block units
+    to_coords: np.ndarray # (N, 3) float32, in block units
+    full_cube: np.ndarray # (N,) bool, element spans the whole block
+    face_bits: np.ndarray # (N,) uint8, faces with a resolved texture
+    face_tint: np.ndarray # (N,) uint8, faces with a tintindex
+    face_texture: list # N tuples of resolved texture names (None for missing faces)
+    is_full_cube: bool = False # a single full cube element, drawn by render_full_cube
+    complete: bool = True # False if an ancestor model failed to load, see loader.resolve_model
+
+def palette_sprite(sprite):
+    """
+    Converts an RGBA sprite to a palette ('P') image with per-entry alpha, if it has at most
+    256 distinct colors, so it is stored and decoded as 1 byte per pixel. This is lossless:
+    converting the result back to RGBA gives the same pixels. Otherwise returns the sprite unchanged.
+    """
+    # One uint32 per pixel, so finding the distinct colors is a flat sort
+    pixels = np.ascontiguousarray(sprite).view(np.uint32).ravel()
+    colors, indices = np.unique(pixels, return_inverse=True)
+    if len(colors) > 256:
+        return sprite
+    colors = colors.view(np.uint8).reshape(-1, 4)
+    paletted = Image.fromarray(indices.reshape(sprite.height, sprite.width).astype(np.uint8), 'P')
+    paletted.putpalette(colors[:, :3].tobytes(), 'RGB')
+    paletted.info['transparency'] = colors[:, 3].tobytes()
+    return paletted
+
+def sprite_cache_path(block_name, face_mask, scale):
+    """
+    Returns the on-disk cache file for a block sprite.
+    """
+    key = f"{SPRITE_CACHE_VERSION}|{block_name}|{face_mask}|{scale}"
+    digest = hashlib.blake2b(key.encode()).hexdigest()[:16]
+    return os.path.join(SPRITE_CACHE_DIR, f"{digest}.png")
+
 class LitematicRenderer:
     def __init__(self, litematic_path):
         self.schem = Schematic.load(litematic_path)
         self.reg = list(self.schem.regions.values())[0] # Assume single region for now
-        self.block_sprites = {} # Cache for rendered block sprites
+        self.block_sprites = _BLOCK_SPRITES # Cache for rendered block sprites
+        self.texture_arrays = _TEXTURE_ARRAYS # Cache for RGBA texture arrays, by (texture, tint or None)
+        self._compiled = _COMPILED_MODELS # Cache for compiled models, by block id
+        # Models and textures that failed to load (e.g. a download error) are only remembered
+        # for this render, so the shared caches above never keep a transient failure
+        self._incomplete_models = {} # Block id -> CompiledModel with a missing ancestor, or None
+        self._missing_textures = set() # Texture refs that couldn't be loaded, with any tint
+        
+        # Raw block storage: palette indices in a (width, height, length) array.
+        # This is a private litemapy field, so fall back to getblock() if it ever changes.
+        self._palette = self.reg.palette
+        self._blocks = getattr(self.reg, '_Region__blocks', None)
+        if not isinstance(self._blocks, np.ndarray) or self._blocks.ndim != 3:
+            self._blocks = None
         
-    def render_block_to_sprite(self, block_name, scale=32, visible_faces=None):
+        # Download missing models/textures up front instead of one by one while rendering
+        failed_models, failed_textures = prefetch_assets(sorted({block.id for block in self._palette} - {"minecraft:air"}))
+        # Assets that failed here aren't requested again during this render
+        for block_id, model in failed_models.items():
+            self._compile_resolved(block_id, model, False)
+        self._missing_textures.update(failed_textures)
+        
+        # Interned block ids: "minecraft:air" is always AIR_ID, then one per unique palette id
+        self._id_to_int = {}
+        self._int_to_id = []
+        self._intern("minecraft:air")
+        self._palette_ids = np.array([self._intern(block.id) for block in self._palette], dtype=np.int32)
+        
+        # Premultiplied sprites of this render by (interned id, face mask), in front of the shared block_sprites
+        self._sprite_lut = {}
+        
+        # Transparency bitmap by interned id, so culling tests transparent[block] directly
+        self._transparent = np.array([is_transparent(block_id) for block_id in self._int_to_id], dtype=bool)
+        
+        # Face transforms of the full cube, per sprite scale
+        self._face_xforms = {}
+        self.cube_face_xforms(SPRITE_SCALE)
+        
+    def render_block_to_sprite(self, block_name, scale=SPRITE_SCALE, face_mask=ALL_FACES):
         """
         Renders a single block model to an isometric sprite.
+        face_mask: visible faces, as FACE_EAST | FACE_SOUTH | FACE_UP bits.
         """
-        if visible_faces is None:
-            visible_faces = ['east', 'south', 'up']
-            
-        cache_key = (block_name, tuple(sorted(visible_faces)))
+        cache_key = (block_name, face_mask, scale)
         if cache_key in self.block_sprites:
             return self.block_sprites[cache_key]
+        
+        cache_file = sprite_cache_path(block_name, face_mask, scale)
+        if os.path.exists(cache_file):
+            # Sprites may be stored paletted, see palette_sprite
+            try:
+                with Image.open(cache_file) as cached:
+                    sprite = cached.convert('RGBA')
+            except OSError as e:
+                # Treat an unreadable cached sprite as missing, it is overwritten below
+                print(f"Warning: Ignoring invalid cached sprite {cache_file}: {e}")
+            else:
+                self.block_sprites[cache_key] = sprite
+                return sprite
             
-        model = parse_model(block_name)
-        if not model:
+        compiled = self._compile_model(block_name)
+        if compiled is None:
             return None
             
         # Create a canvas for the sprite
         # Size depends on scale. Standard block is 16x16x16 units.
         # Isometric projection makes it wider/taller.
         w, h = scale * 4, scale * 4
-        sprite = Image.new('RGBA', (w, h), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(sprite)
+        sprite = np.zeros((h, w, 4), dtype=np.uint8)
         
-        elements = model.get('elements', [])
-        if not elements:
-            # Fallback for blocks without elements (like air or simple cubes if omitted)
-            # But standard models usually have elements.
-            # If no elements but parent is 'block/cube_all', we might need to handle built-in shapes.
-            # For now, let's assume elements exist or we skip.
-            pass
-            
-        # Sort elements? Usually not needed if we draw in order, but for transparency...
+        if compiled.is_full_cube:
+            complete = self.render_full_cube(sprite, compiled, scale, face_mask)
+        else:
+            complete = self.render_elements(sprite, compiled, scale, face_mask)
+        complete = complete and compiled.complete
         
+        sprite = Image.fromarray(sprite, 'RGBA')
+        if not complete:
+            # A model or texture failed to load (e.g. a download error): keep such sprites out of the caches,
+            # so they are drawn again once the texture is available
+            return sprite
+        
+        stored = palette_sprite(sprite)
+        try:
+            write_cache_file(cache_file, lambda path: stored.save(
+                path, format="PNG", optimize=False, compress_level=1, transparency=stored.info.get('transparency')
+            ))
+        except OSError as e:
+            # The disk cache is only an optimization, the sprite is still kept in memory
+            print(f"Warning: Could not cache sprite {cache_file}: {e}")
+        
+        self.block_sprites[cache_key] = sprite
+        return sprite
+
+    def render_full_cube(self, sprite, compiled, scale, face_mask):
+        """
+        Draws a model made of one full cube element into the sprite array.
+        The common case (stone, planks, wool, ...): three faces with the precomputed cube transforms.
+        Returns False if the texture of a visible face could not be loaded.
+        """
+        complete = True
+        xforms = self.cube_face_xforms(scale)
+        visible = int(compiled.face_bits[0]) & face_mask
+        tinted = int(compiled.face_tint[0])
+        for (face_name, face_bit), texture_ref in zip(RENDER_ORDER, compiled.face_texture[0]):
+            if visible & face_bit:
+                texture = self._texture_array(texture_ref, GRASS_TINT if tinted & face_bit else None)
+                if texture is None:
+                    complete = False
+                    continue
+                self.paste_face(sprite, texture, xforms[face_name])
+        return complete
+
+    def render_elements(self, sprite, compiled, scale, face_mask):
+        """
+        Draws every element of a model into the sprite array.
+        Returns False if the texture of a visible face could not be loaded.
+        """
+        complete = True
         # Center of drawing
+        h, w = sprite.shape[:2]
         cx, cy = w // 2, h // 2
+        cube_xforms = self.cube_face_xforms(scale)
         
         # Iterate elements
-        for element in elements:
-            from_coord = np.array(element['from']) / 16.0
-            to_coord = np.array(element['to']) / 16.0
-            
-            # Draw faces. For standard isometric (view from +x, +y, +z), we see Up, South, East?
-            # Actually standard isometric is usually 45 deg Y rot, 30 deg X rot.
-            # We see Top, and two sides (North/East or South/East etc depending on quadrant).
-            # Let's assume we see Up, North, East (or similar).
-            
-            # Faces: up, down, north, south, east, west
-            # defined in model.
+        for e, textures in enumerate(compiled.face_texture):
+            face_bits = int(compiled.face_bits[e]) & face_mask
+            if not face_bits:
+                continue
             
-            # We need to project faces.
+            from_coord = compiled.from_coords[e].tolist()
+            to_coord = compiled.to_coords[e].tolist()
+            tint_bits = int(compiled.face_tint[e])
             
-            faces = element.get('faces', {})
-            
-            # Define render order for painter's algorithm (back to front)
-            # If viewing from front-right-top:
-            # We see: Up, South, East (assuming Z is South, X is East).
-            # So draw: Down, North, West (hidden), then East, South, Up.
-            
-            render_order = ['east', 'south', 'up'] # Only draw visible faces for optimization?
-            # Wait, if the block is not a full cube, we might see others.
-            # But for a simple renderer, let's just draw visible ones.
-            
-            for face_name in render_order:
-                if face_name not in faces:
+            for i, (face_name, face_bit) in enumerate(RENDER_ORDER):
+                if not face_bits & face_bit:
                     continue
                 
-                if face_name not in visible_faces:
+                # Apply tint if needed
+                # Simple hardcoded tint for now (Generic Green)
+                # Ideally this depends on biome and block type
+                tint = GRASS_TINT if tint_bits & face_bit else None
+                texture = self._texture_array(textures[i], tint)
+                if texture is None:
+                    complete = False
                     continue
+
+                if compiled.full_cube[e]:
+                    xform = cube_xforms[face_name]
+                else:
+                    # Calculate corners of the face
+                    # This requires knowing which coords correspond to the face
+                    corners_3d = self.get_face_corners(from_coord, to_coord, face_name)
+                    
+                    # Project to 2D
+                    corners_2d = []
+                    for x, y, z in corners_3d:
+                        ix, iy = isometric_projection(x, y, z, scale=scale)
+                        corners_2d.append((cx + ix, cy - iy)) # Invert Y for image coords
+                    xform = self.build_face_xform(corners_2d)
                 
-                face_data = faces[face_name]
-                texture_ref = face_data.get('texture', '')
+                if xform is None:
+                    continue # Degenerate
+                
+                # Draw texture mapped to quad
+                self.paste_face(sprite, texture, xform)
+        return complete
+
+    def _compile_model(self, block_name):
+        """
+        Flattens a block model into a CompiledModel, with all texture variables resolved.
+        Returns None if the model could not be loaded.
+        """
+        if block_name in self._compiled:
+            return self._compiled[block_name]
+        if block_name in self._incomplete_models:
+            return self._incomplete_models[block_name]
+        
+        model, complete = resolve_model(block_name)
+        return self._compile_resolved(block_name, model, complete)
+
+    def _compile_resolved(self, block_name, model, complete):
+        """
+        Compiles a resolved model (see resolve_model) and caches the result by completeness.
+        """
+        if not model:
+            self._incomplete_models[block_name] = None
+            return None
+        
+        elements = model.get('elements', [])
+        # Blocks without elements (built-in shapes) compile to an empty model
+        
+        n = len(elements)
+        from_coords = np.zeros((n, 3), dtype=np.float32)
+        to_coords = np.zeros((n, 3), dtype=np.float32)
+        face_bits = np.zeros(n, dtype=np.uint8)
+        face_tint = np.zeros(n, dtype=np.uint8)
+        face_texture = []
+        
+        for e, element in enumerate(elements):
+            from_coords[e] = np.array(element['from']) / 16.0
+            to_coords[e] = np.array(element['to']) / 16.0
+            
+            # Only the faces we ever draw; see RENDER_ORDER
+            faces = element.get('faces', {})
+            textures = []
+            for face_name, face_bit in RENDER_ORDER:
+                face_data = faces.get(face_name)
+                texture_ref = face_data.get('texture', '') if face_data else ''
                 
                 # Resolve texture variables recursively
                 while texture_ref.startswith('#'):
@@ -102,78 +386,55 @@ class LitematicRenderer:
                         break
                     texture_ref = resolved
                 
-                if texture_ref.startswith('#'):
-                    # Failed to resolve fully
-                    continue
-
-                texture_img = get_texture_image(texture_ref)
-                if not texture_img:
+                if not face_data or texture_ref.startswith('#'):
+                    # Missing face, or failed to resolve fully
+                    textures.append(None)
                     continue
                 
-                # Apply tint if needed
+                textures.append(texture_ref)
+                face_bits[e] |= face_bit
                 if 'tintindex' in face_data:
-                    # Simple hardcoded tint for now (Generic Green)
-                    # Ideally this depends on biome and block type
-                    tint_color = (145, 189, 89, 255) # Minecraft grass green
-                    
-                    # Apply tint
-                    # Convert to RGBA
-                    texture_img = texture_img.convert('RGBA')
-                    
-                    # Multiply color
-                    data = np.array(texture_img)
-                    r, g, b, a = data.T
-                    
-                    # Normalize tint
-                    tr, tg, tb, ta = tint_color
-                    
-                    r = (r * tr // 255).astype(np.uint8)
-                    g = (g * tg // 255).astype(np.uint8)
-                    b = (b * tb // 255).astype(np.uint8)
-                    
-                    texture_img = Image.fromarray(np.dstack((r, g, b, a)))
-
-                # Calculate corners of the face
-                # This requires knowing which coords correspond to the face
-                corners_3d = self.get_face_corners(from_coord, to_coord, face_name)
-                
-                # Project to 2D
-                corners_2d = []
-                for x, y, z in corners_3d:
-                    ix, iy = isometric_projection(x, y, z, scale=scale)
-                    corners_2d.append((cx + ix, cy - iy)) # Invert Y for image coords
-                
-                # Draw texture mapped to quad
-                self.draw_textured_face(sprite, texture_img, corners_2d)
-                
-        self.block_sprites[cache_key] = sprite
-        return sprite
+                    face_tint[e] |= face_bit
+            face_texture.append(tuple(textures))
+        
+        full_cube = ~from_coords.any(axis=1) & (to_coords == 1.0).all(axis=1)
+        is_full_cube = n == 1 and bool(full_cube[0])
+        compiled = CompiledModel(from_coords, to_coords, full_cube, face_bits, face_tint, face_texture, is_full_cube, complete)
+        if complete:
+            self._compiled[block_name] = compiled
+        else:
+            self._incomplete_models[block_name] = compiled
+        return compiled
 
-    def draw_textured_face(self, canvas, texture, corners):
+    def build_face_xform(self, corners):
         """
-        Warps the texture to the quad defined by corners and pastes it onto the canvas.
-        corners: [(x0, y0), (x1, y1), (x2, y2), (x3, y3)] (TL, TR, BR, BL)
+        Precomputes the mapping of a texture onto the quad defined by corners (TL, TR, BR, BL).
+        Returns (affine6, bbox, poly_mask), where bbox is the quad's pixel box on the canvas,
+        poly_mask is the quad rasterised into that box as a bool array and affine6 maps box
+        pixels to texture coordinates in [0, 1].
+        Returns None if the quad is degenerate.
         """
-        # Create a mask for the polygon
-        w, h = canvas.size
-        mask = Image.new('L', (w, h), 0)
-        draw = ImageDraw.Draw(mask)
-        draw.polygon(corners, fill=255)
+        xs = [x for x, _ in corners]
+        ys = [y for _, y in corners]
+        # One extra pixel so the polygon's right/bottom edge is never clipped
+        bx0, by0 = math.floor(min(xs)), math.floor(min(ys))
+        bx1, by1 = math.floor(max(xs)) + 1, math.floor(max(ys)) + 1
         
-        # Calculate affine transform to map texture to quad
-        # We want to map texture (0,0)->TL, (w,0)->TR, (0,h)->BL
-        # Destination points
-        (x0, y0), (x1, y1), (x2, y2), (x3, y3) = corners
+        # Corners relative to the box
+        (x0, y0), (x1, y1), (x2, y2), (x3, y3) = [(x - bx0, y - by0) for x, y in corners]
         
-        tw, th = texture.size
+        w, h = bx1 - bx0, by1 - by0
+        mask_tile = _POOL.acquire((w, h), 'L')
+        try:
+            mask_tile.paste(0, (0, 0, w, h))
+            ImageDraw.Draw(mask_tile).polygon([(x0, y0), (x1, y1), (x2, y2), (x3, y3)], fill=255)
+            poly_mask = np.asarray(mask_tile)[:h, :w] > 0
+        finally:
+            _POOL.release(mask_tile)
         
         # Solve for affine coefficients
-        # x = a*u + b*v + c
-        # y = d*u + e*v + f
-        # Wait, PIL transform takes inverse matrix: u = a*x + b*y + c...
-        
-        # We need to map destination (x,y) to source (u,v)
-        # Using 3 points: TL(x0,y0)->(0,0), TR(x1,y1)->(tw,0), BL(x3,y3)->(0,th)
+        # PIL transform takes the inverse matrix: u = a*x + b*y + c, v = d*x + e*y + f
+        # Using 3 points: TL(x0,y0)->(0,0), TR(x1,y1)->(1,0), BL(x3,y3)->(0,1)
         
         dx1 = x1 - x0
         dy1 = y1 - y0
@@ -183,26 +444,75 @@ class LitematicRenderer:
         det = dx1 * dy2 - dx2 * dy1
         
         if abs(det) < 1e-6:
-            return # Degenerate
+            return None
             
-        a = (tw * dy2) / det
-        b = (-tw * dx2) / det
+        a = dy2 / det
+        b = -dx2 / det
         c = -a * x0 - b * y0
         
-        d = (-th * dy1) / det
-        e = (th * dx1) / det
+        d = -dy1 / det
+        e = dx1 / det
         f = -d * x0 - e * y0
         
-        data = (a, b, c, d, e, f)
+        return (a, b, c, d, e, f), (bx0, by0, bx1, by1), poly_mask
+
+    def paste_face(self, canvas, texture, xform):
+        """
+        Warps an RGBA texture array into the face box described by xform (see build_face_xform)
+        and writes the face pixels into the (h, w, 4) canvas array.
+        """
+        affine6, bbox, poly_mask = xform
+        bx0, by0, bx1, by1 = bbox
+        ch, cw = canvas.shape[:2]
+        if bx0 >= 0 and by0 >= 0 and bx1 <= cw and by1 <= ch:
+            # Warp straight into the canvas, no per-face tile
+            warp_face(texture, affine6, bbox, poly_mask, out=canvas[by0:by1, bx0:bx1])
+            return
         
-        # Transform texture to canvas size
-        try:
-            transformed = texture.transform((w, h), Image.AFFINE, data, resample=Image.NEAREST)
-            
-            # Paste using mask
-            canvas.paste(transformed, (0, 0), mask)
-        except Exception as e:
-            print(f"Error transforming texture: {e}")
+        # Face sticks out of the canvas: warp into a tile and copy the part that fits
+        tile = warp_face(texture, affine6, bbox, poly_mask)
+        x0, y0 = max(bx0, 0), max(by0, 0)
+        x1, y1 = min(bx1, cw), min(by1, ch)
+        if x0 >= x1 or y0 >= y1:
+            return
+        tile = tile[y0 - by0:y1 - by0, x0 - bx0:x1 - bx0]
+        visible = poly_mask[y0 - by0:y1 - by0, x0 - bx0:x1 - bx0]
+        canvas[y0:y1, x0:x1][visible] = tile[visible]
+
+    def _texture_array(self, texture_ref, tint=None):
+        """
+        Returns a texture as an RGBA uint8 array, tinted if tint is given, or None if it can't be loaded.
+        """
+        key = (texture_ref, tint)
+        if key not in self.texture_arrays:
+            if texture_ref in self._missing_textures:
+                return None
+            texture_img = get_texture_image(texture_ref)
+            if not texture_img:
+                self._missing_textures.add(texture_ref)
+                return None
+            rgba = np.array(texture_img.convert('RGBA'))
+            if tint is not None:
+                _apply_tint(rgba, tint)
+            self.texture_arrays[key] = rgba
+        return self.texture_arrays[key]
+
+    def cube_face_xforms(self, scale):
+        """
+        Returns the face transforms of a full 16x16x16 cube in a sprite of the given scale.
+        Every full cube block draws the same three faces, so this is computed once per scale.
+        """
+        if scale not in self._face_xforms:
+            cx, cy = scale * 2, scale * 2 # Sprite center, see render_block_to_sprite
+            xforms = {}
+            for face_name in ('east', 'south', 'up'):
+                corners_2d = []
+                for x, y, z in self.get_face_corners((0.0, 0.0, 0.0), (1.0, 1.0, 1.0), face_name):
+                    ix, iy = isometric_projection(x, y, z, scale=scale)
+                    corners_2d.append((cx + ix, cy - iy))
+                xforms[face_name] = self.build_face_xform(corners_2d)
+            self._face_xforms[scale] = xforms
+        return self._face_xforms[scale]
 
     def get_face_corners(self, p1, p2, face):
         x1, y1, z1 = p1
@@ -224,24 +534,108 @@ class LitematicRenderer:
             return [(x1, y2, z1), (x1, y2, z2), (x1, y1, z2), (x1, y1, z1)]
         return []
 
+    def _intern(self, block_id):
+        """
+        Returns the small integer id of a block id string, assigning one on first sight.
+        """
+        idx = self._id_to_int.get(block_id)
+        if idx is None:
+            idx = len(self._int_to_id)
+            self._id_to_int[block_id] = idx
+            self._int_to_id.append(block_id)
+        return idx
+
+    def _grid_shape(self):
+        """
+        Returns the (y, z, x) shape of the region's block grid.
+        """
+        return (
+            self.reg.max_y() - self.reg.min_y() + 1,
+            self.reg.max_z() - self.reg.min_z() + 1,
+            self.reg.max_x() - self.reg.min_x() + 1,
+        )
+
+    def _has_block_buffer(self, shape):
+        """
+        Whether litemapy's palette index buffer (x, y, z) is available and matches the grid shape.
+        """
+        return self._blocks is not None and self._blocks.shape == (shape[2], shape[0], shape[1])
+
+    def _build_block_grid(self):
+        """
+        Reads the region into an int32 array of interned block ids, indexed (y, z, x).
+        """
+        min_x, max_x = self.reg.min_x(), self.reg.max_x()
+        min_y, max_y = self.reg.min_y(), self.reg.max_y()
+        min_z, max_z = self.reg.min_z(), self.reg.max_z()
+        shape = self._grid_shape()
+        
+        # Fast path: map litemapy's palette index buffer (x, y, z) through the palette
+        if self._has_block_buffer(shape):
+            return np.ascontiguousarray(self._palette_ids[self._blocks].transpose(1, 2, 0))
+        
+        ids = []
+        for y in range(min_y, max_y + 1):
+            for z in range(min_z, max_z + 1):
+                for x in range(min_x, max_x + 1):
+                    ids.append(self._id_to_int[self.reg.getblock(x, y, z).id])
+        
+        return np.asarray(ids, dtype=np.int32).reshape(shape)
+
+    def _cull_blocks(self):
+        """
+        Returns the solid blocks of the region with their visible faces, see culling.cull.
+        Sparse regions (mostly air) skip the dense block grid and only look at their solid cells.
+        """
+        shape = self._grid_shape()
+        if self._has_block_buffer(shape):
+            # Solid cells straight from litemapy's palette index buffer, as a (y, z, x) bool mask.
+            # Usually a single palette index is air, so this is one comparison per cell.
+            air_indices = np.flatnonzero(self._palette_ids == AIR_ID)
+            if air_indices.size:
+                palette_yzx = self._blocks.transpose(1, 2, 0)
+                solid = np.empty(shape, dtype=bool)
+                np.not_equal(palette_yzx, int(air_indices[0]), out=solid)
+                for index in air_indices[1:]:
+                    solid &= palette_yzx != int(index)
+                if np.count_nonzero(solid) < SPARSE_DENSITY * solid.size:
+                    keys = np.flatnonzero(solid)
+                    yz, xi = np.divmod(keys, shape[2])
+                    yi, zi = np.divmod(yz, shape[1])
+                    blocks = self._palette_ids[self._blocks[xi, yi, zi]]
+                    return cull_sparse(keys, blocks, shape, self._transparent)
+                # Dense region: free the mask before building the grid
+                del solid
+        
+        return cull(self._build_block_grid(), self._transparent)
+
     def render(self, output_path):
         # Determine bounds
         min_x, max_x = self.reg.min_x(), self.reg.max_x()
         min_y, max_y = self.reg.min_y(), self.reg.max_y()
         min_z, max_z = self.reg.min_z(), self.reg.max_z()
         
-        # Calculate canvas size (rough estimate)
-        scale = 32
-        # Isometric width approx: (dx + dz) * scale
-        # Height: (dy + (dx+dz)/2) * scale
-        
-        # Create large canvas
-        canvas_width = 2000
-        canvas_height = 2000
-        canvas = Image.new('RGBA', (canvas_width, canvas_height), (0, 0, 0, 0))
+        # Calculate canvas size
+        # The projection is linear, so the extreme block positions are at the corners of the region
+        scale = SPRITE_SCALE
+        sprite_size = scale * 4 # See render_block_to_sprite
+        corners = [
+            isometric_projection(x, y, z, scale=scale)
+            for x in (min_x, max_x) for y in (min_y, max_y) for z in (min_z, max_z)
+        ]
+        min_ix = min(ix for ix, _ in corners)
+        max_ix = max(ix for ix, _ in corners)
+        min_iy = min(iy for _, iy in corners)
+        max_iy = max(iy for _, iy in corners)
         
-        # Center
-        cx, cy = canvas_width // 2, canvas_height // 2
+        # Center (the projection origin), leaving room for half a sprite plus a margin on each side
+        margin = 1
+        cx = math.ceil(sprite_size // 2 - min_ix) + margin
+        cy = math.ceil(max_iy + sprite_size // 2) + margin
+        canvas_width = math.ceil(cx + max_ix) + sprite_size // 2 + margin
+        canvas_height = math.ceil(cy - min_iy) + sprite_size // 2 + margin
+        # Premultiplied alpha, so blending a sprite is a single multiply-add
+        canvas = np.zeros((canvas_height, canvas_width, 4), dtype=np.uint8)
         
         # Iterate blocks
         # Order: Back to Front, Bottom to Top.
@@ -250,75 +644,42 @@ class LitematicRenderer:
         # Furthest is min_x, min_z (or max, depending on rotation).
         # We want to draw the blocks that are "behind" first.
         
-        # Loop x, y, z
-        for y in range(min_y, max_y + 1):
-            for z in range(min_z, max_z + 1):
-                for x in range(min_x, max_x + 1):
-                    try:
-                        block = self.reg.getblock(x, y, z)
-                        if block.id == "minecraft:air":
-                            continue
-                        
-                        visible_faces = ['east', 'south', 'up']
-                        
-                        # Face Culling
-                        # Check East (+X)
-                        if x + 1 <= max_x:
-                            try:
-                                neighbor = self.reg.getblock(x+1, y, z)
-                                if neighbor.id != "minecraft:air":
-                                    if is_transparent(block.id):
-                                        if neighbor.id == block.id:
-                                            visible_faces.remove('east')
-                                    elif not is_transparent(neighbor.id):
-                                        visible_faces.remove('east')
-                            except: pass
-
-                        # Check South (+Z)
-                        if z + 1 <= max_z:
-                            try:
-                                neighbor = self.reg.getblock(x, y, z+1)
-                                if neighbor.id != "minecraft:air":
-                                    if is_transparent(block.id):
-                                        if neighbor.id == block.id:
-                                            visible_faces.remove('south')
-                                    elif not is_transparent(neighbor.id):
-                                        visible_faces.remove('south')
-                            except: pass
-                            
-                        # Check Up (+Y)
-                        if y + 1 <= max_y:
-                            try:
-                                neighbor = self.reg.getblock(x, y+1, z)
-                                if neighbor.id != "minecraft:air":
-                                    if is_transparent(block.id):
-                                        if neighbor.id == block.id:
-                                            visible_faces.remove('up')
-                                    elif not is_transparent(neighbor.id):
-                                        visible_faces.remove('up')
-                            except: pass
-                            
-                        sprite = self.render_block_to_sprite(block.id, scale=scale, visible_faces=visible_faces)
-                        if sprite:
-                            # Calculate position
-                            ix, iy = isometric_projection(x, y, z, scale=scale)
-                            
-                            # Center on canvas
-                            px = int(cx + ix - sprite.width // 2)
-                            py = int(cy - iy - sprite.height // 2) # Invert Y because y increases upwards in world but downwards in image
-                            
-                            # Paste (using alpha channel as mask)
-                            canvas.paste(sprite, (px, py), sprite)
-                    except Exception as e:
-                        print(f"Error processing block at {x},{y},{z}: {e}")
-                        import traceback
-                        traceback.print_exc()
-        
-        # Crop to content
-        bbox = canvas.getbbox()
-        if bbox:
-            canvas = canvas.crop(bbox)
+        # Face Culling, yields solid blocks in back-to-front order
+        # Sprites are looked up by (interned id, face mask); the block id string
+        # is only needed the first time a combination is seen.
+        sprite_lut = self._sprite_lut
+        blocks = self._cull_blocks()
+        
+        # Canvas position of every block, projected all at once
+        # Round rather than truncate: sin(30) is not exact, so truncation depends on cx/cy
+        ix, iy = isometric_projection(min_x + blocks[:, 0], min_y + blocks[:, 1], min_z + blocks[:, 2], scale=scale)
+        block_px = np.rint(cx + ix).astype(np.int32).tolist()
+        block_py = np.rint(cy - iy).astype(np.int32).tolist() # Invert Y because y increases upwards in world but downwards in image
+        
+        for (xi, yi, zi, block, face_mask), bx, by in zip(blocks.tolist(), block_px, block_py):
+            try:
+                key = (block, face_mask)
+                if key in sprite_lut:
+                    entry = sprite_lut[key]
+                else:
+                    sprite = self.render_block_to_sprite(self._int_to_id[block], scale=scale, face_mask=face_mask)
+                    entry = premultiply_sprite(sprite) if sprite else None
+                    sprite_lut[key] = entry
+                if entry:
+                    sprite_pm, ox, oy = entry
+                    blend_over(canvas, sprite_pm, bx + ox, by + oy)
+            except Exception as e:
+                print(f"Error processing block at {min_x + xi},{min_y + yi},{min_z + zi}: {e}")
+                import traceback
+                traceback.print_exc()
+        
+        # Crop to content (non-transparent pixels)
+        alpha = canvas[..., 3]
+        rows = np.flatnonzero(alpha.any(axis=1))
+        cols = np.flatnonzero(alpha.any(axis=0))
+        if rows.size:
+            canvas = canvas[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
             
-        canvas.save(output_path)
+        unpremultiply(canvas).save(output_path)
         print(f"Render saved to {output_path}")
 
@@ -0,0 +1,75 @@
+import math
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError: # Numba is optional, fall back to the NumPy implementation
+    njit = None
+
+def _fixed_coefficients(texture, affine6):
+    """
+    Scales affine6 to texel units and converts it to 16.16 fixed point.
+    Returns (u0, u_dx, u_dy, v0, v_dx, v_dy): the texel coordinate of the first pixel center
+    and its step per pixel in x and y, sampled the same way PIL's AFFINE/NEAREST transform
+    does, so the result is pixel-identical to Image.transform.
+    """
+    th, tw = texture.shape[:2]
+    a, b, c, d, e, f = affine6
+    a, b, c, d, e, f = a * tw, b * tw, c * tw, d * th, e * th, f * th
+    
+    def fix(value):
+        return math.floor(value * 65536.0 + 0.5)
+    
+    return (fix(c + a * 0.5 + b * 0.5), fix(a), fix(b),
+            fix(f + d * 0.5 + e * 0.5), fix(d), fix(e))
+
+def _warp_numpy(out, texture, poly_mask, u0, u_dx, u_dy, v0, v_dx, v_dy):
+    th, tw = texture.shape[:2]
+    ys, xs = np.mgrid[0:poly_mask.shape[0], 0:poly_mask.shape[1]]
+    u = (u0 + xs * u_dx + ys * u_dy) >> 16
+    v = (v0 + xs * v_dx + ys * v_dy) >> 16
+    inside = poly_mask & (u >= 0) & (u < tw) & (v >= 0) & (v < th)
+    
+    out[poly_mask] = 0
+    out[inside] = texture[v[inside], u[inside]]
+
+if njit is not None:
+    @njit(cache=True)
+    def _warp_numba(out, texture, poly_mask, u0, u_dx, u_dy, v0, v_dx, v_dy):
+        th, tw = texture.shape[0], texture.shape[1]
+        h, w = poly_mask.shape
+        for y in range(h):
+            # Walk the row incrementally, no multiplies per pixel
+            u = u0 + y * u_dy
+            v = v0 + y * v_dy
+            for x in range(w):
+                if poly_mask[y, x]:
+                    tu = u >> 16
+                    tv = v >> 16
+                    if 0 <= tu < tw and 0 <= tv < th:
+                        for ch in range(4):
+                            out[y, x, ch] = texture[tv, tu, ch]
+                    else:
+                        for ch in range(4):
+                            out[y, x, ch] = 0
+                u += u_dx
+                v += v_dx
+
+def warp_face(texture, affine6, bbox, poly_mask, out=None):
+    """
+    Nearest-neighbour warp of an RGBA texture array into a face box.
+    affine6 maps box pixels to texture coordinates in [0, 1] and poly_mask is the
+    (h, w) bool mask of the face, see LitematicRenderer.build_face_xform.
+    Face pixels outside the texture are transparent.
+    Writes into out (an (h, w, 4) uint8 array, pixels outside the face are left untouched)
+    if given, otherwise into a new transparent array. Returns the array written to.
+    """
+    bx0, by0, bx1, by1 = bbox
+    if out is None:
+        out = np.zeros((by1 - by0, bx1 - bx0, 4), dtype=np.uint8)
+    coefficients = _fixed_coefficients(texture, affine6)
+    if njit is not None:
+        _warp_numba(out, texture, poly_mask, *coefficients)
+    else:
+        _warp_numpy(out, texture, poly_mask, *coefficients)
+    return out
@@ -5,6 +5,7 @@ def isometric_projection(x, y, z, scale=1.0):
     """
     Projects 3D coordinates (x, y, z) to 2D isometric coordinates (iso_x, iso_y).
     Assumes standard isometric view (45 deg rotation, 30 deg tilt).
+    Also works element-wise on NumPy arrays of coordinates.
     """
     iso_x = (x - z) * math.cos(math.radians(30)) * scale
     iso_y = y * scale - (x + z) * math.sin(math.radians(30)) * scale